@@ -4,78 +4,392 @@ Offline analysis of downloaded @durabulk images using YOLOv8 + EasyOCR.
 Reads image-list.json, processes each image, writes results.json.
 
 Usage:
-    pip install ultralytics easyocr pillow
+    pip install ultralytics easyocr pillow onnx onnxruntime
     python analyze.py
+
+    # Run YOLOv8 and the EasyOCR text detector through PyTorch instead of ONNX Runtime:
+    DURABULK_BACKEND=torch python analyze.py
+
+    # Force the INT8 (1) or FP32 (0) ONNX model instead of choosing by CPU:
+    USE_INT8=0 python analyze.py
+
+    # Run YOLOv8 as an FP16 OpenVINO model (pip install openvino):
+    DURABULK_BACKEND=openvino python analyze.py
+
+    # Analyze in one worker process per physical core (e.g. 4) instead of threads:
+    ANALYZE_PROCESSES=4 python analyze.py
 """
 
+import bisect
+import collections
 import json
+import multiprocessing
 import os
 import re
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import cv2
+import numpy as np
+import torch
 from PIL import Image
 from ultralytics import YOLO
 import easyocr
 
+from craft_onnx import export_craft, onnxruntime_available, use_onnx_detector
+from text_match import alnum
+
 IMAGES_DIR = "images"
 IMAGE_LIST = "image-list.json"
 RESULTS_FILE = "results.json"
+# Written by download_images.py: image name -> post caption
+CAPTIONS_FILE = "captions.json"
+# The account's own handle and hashtag, and Instagram's "Photo by <owner> on
+# <date>" alt text preamble, name Dura Bulk on every post, so they are
+# stripped from captions before matching
+CAPTION_NOISE = re.compile(
+    r"[@#]durabulk\b|\b(?:photo|image) (?:shared )?by .*? on \w+ \d{1,2}, \d{4}",
+    re.IGNORECASE,
+)
+# Thumbnails and avatars this small never show readable hull lettering
+MIN_IMAGE_SIDE = 320
+YOLO_BATCH_SIZE = 16
+YOLO_WEIGHTS = "yolov8n.pt"
+YOLO_IMGSZ = int(os.environ.get("YOLO_IMGSZ", "640"))
+YOLO_BACKEND = os.environ.get("DURABULK_BACKEND", "onnx")
+CALIBRATION_IMAGES = 20
+# "1" forces the INT8 ONNX model and "0" the FP32 one; unset picks INT8 on VNNI CPUs
+USE_INT8 = os.environ.get("USE_INT8")
+OCR_BATCH_SIZE = 32
+OCR_CANVAS_GAP = 16
+ANALYZE_WORKERS = min(4, os.cpu_count() or 1)
+# Cloud vCPUs are usually hyperthreads; one inference thread per physical core
+# avoids oversubscribing them
+INFERENCE_THREADS = max(1, (os.cpu_count() or 2) // 2)
+# Above 1, images are analyzed in this many worker processes instead of threads
+ANALYZE_PROCESSES = int(os.environ.get("ANALYZE_PROCESSES", "1"))
+
+# Crops below these are skipped without OCR (see has_legible_detail)
+OCR_MIN_CROP_SIDE = 24
+OCR_MIN_SHARPNESS = float(os.environ.get("OCR_MIN_SHARPNESS", "50"))
+OCR_MIN_EDGE_DENSITY = float(os.environ.get("OCR_MIN_EDGE_DENSITY", "0.02"))
+
+YOLO_PREDICT_ARGS = {
+    "imgsz": YOLO_IMGSZ,
+    "classes": [8],  # 8 = boat in COCO
+    "conf": 0.35,
+    "iou": 0.5,
+    "max_det": 20,
+    "verbose": False,
+}
+
+# Loaded once per process, so other scripts can import this module and reuse them
+_model = None
+_reader = None
 
 
 def fuzzy_match_dura_bulk(text):
     """Check if text contains something close to 'dura bulk'."""
-    lower = text.lower().strip()
-    if "dura" in lower and "bulk" in lower:
-        return True
-    cleaned = re.sub(r"[^a-z0-9]", "", lower)
-    return "durabulk" in cleaned
+    cleaned = alnum(text)
+    # Also covers "durabulk" and "dura bulk" split by punctuation or spaces
+    return b"dura" in cleaned and b"bulk" in cleaned
 
 
-def analyze_image(model, reader, img_path):
-    """Run YOLOv8 boat detection + EasyOCR on a single image.
-    Returns (is_dura_bulk, details_string).
-    """
+def cpu_has_vnni():
+    """Check /proc/cpuinfo for the AVX-512 VNNI / AVX-VNNI int8 dot-product instructions."""
     try:
-        img = Image.open(img_path).convert("RGB")
-    except Exception as e:
-        return False, f"Could not open image: {e}"
-
-    results = model(img, verbose=False)
-    boats_found = 0
-    all_ocr_text = []
-
-    for result in results:
-        for box in result.boxes:
-            cls_id = int(box.cls[0])
-            if cls_id != 8:  # 8 = boat in COCO
-                continue
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_vnni" in flags or "avx_vnni" in flags
+
+
+def letterbox(img_path, size=YOLO_IMGSZ):
+    """Load an image as a 1x3xSxS float32 blob, padded the same way YOLOv8 does.
+    The image is resized straight into the padded canvas, and blobFromImage does
+    the BGR->RGB swap, HWC->CHW transpose and 1/255 scaling in a single pass.
+    """
+    img = cv2.imread(img_path)
+    height, width = img.shape[:2]
+    scale = size / max(height, width)
+    new_h, new_w = round(height * scale), round(width * scale)
+    top, left = (size - new_h) // 2, (size - new_w) // 2
+
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    return cv2.dnn.blobFromImage(canvas, scalefactor=1 / 255.0, swapRB=True)
+
+
+def quantize_int8(onnx_path, int8_path):
+    """Statically quantize the exported YOLOv8 ONNX graph to INT8 (QDQ format).
+    Calibrates on up to CALIBRATION_IMAGES images from IMAGES_DIR.
+    Returns False if there is nothing to calibrate on.
+    """
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    names = sorted(
+        f for f in os.listdir(IMAGES_DIR)
+        if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    )[:CALIBRATION_IMAGES] if os.path.isdir(IMAGES_DIR) else []
+    if not names:
+        return False
+
+    input_name = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class ImageCalibrationReader(CalibrationDataReader):
+        def __init__(self):
+            self.paths = iter(os.path.join(IMAGES_DIR, n) for n in names)
+
+        def get_next(self):
+            path = next(self.paths, None)
+            return None if path is None else {input_name: letterbox(path)}
+
+    # Keep the Detect head (model.22) in FP32: its output concatenates box
+    # coordinates (0..640) with class scores (0..1), which can't share one scale.
+    graph = onnx.load(onnx_path).graph
+    head_nodes = [n.name for n in graph.node if n.name.startswith("/model.22/")]
+
+    quantize_static(
+        onnx_path,
+        int8_path,
+        ImageCalibrationReader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        weight_type=QuantType.QInt8,
+        activation_type=QuantType.QInt8,
+        nodes_to_exclude=head_nodes,
+    )
+    return True
+
+
+def load_model():
+    """Load the YOLOv8 boat detector for DURABULK_BACKEND.
+
+    "torch" runs yolov8n.pt directly. "onnx" exports it once to ONNX and runs it
+    through ONNX Runtime, using an INT8-quantized copy on CPUs with VNNI
+    (INT8 is slower than FP32 on CPUs without it). "openvino" exports it once
+    to an FP16 OpenVINO model.
+    """
+    stem = os.path.splitext(YOLO_WEIGHTS)[0]
+    if YOLO_BACKEND == "torch":
+        return YOLO(YOLO_WEIGHTS)
+    if YOLO_BACKEND == "openvino":
+        openvino_dir = f"{stem}_openvino_model"
+        if not os.path.isdir(openvino_dir):
+            YOLO(YOLO_WEIGHTS).export(format="openvino", imgsz=YOLO_IMGSZ, half=True, dynamic=True)
+        return YOLO(openvino_dir, task="detect")
+    if YOLO_BACKEND != "onnx":
+        print(f"Error: unknown DURABULK_BACKEND '{YOLO_BACKEND}' (expected torch, onnx or openvino).")
+        sys.exit(1)
+    if not onnxruntime_available():
+        print("  onnxruntime is not installed, running YOLOv8 through PyTorch.")
+        return YOLO(YOLO_WEIGHTS)
+
+    onnx_path = f"{stem}.onnx"
+    if not os.path.exists(onnx_path):
+        YOLO(YOLO_WEIGHTS).export(format="onnx", imgsz=YOLO_IMGSZ, opset=17, simplify=True, dynamic=True)
+
+    int8_path = f"{stem}_int8.onnx"
+    use_int8 = cpu_has_vnni() if USE_INT8 is None else USE_INT8 == "1"
+    if use_int8:
+        if os.path.exists(int8_path) or quantize_int8(onnx_path, int8_path):
+            return YOLO(int8_path, task="detect")
+        if USE_INT8 == "1":
+            # Nothing to calibrate on, but weight-only dynamic quantization needs no data
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+            return YOLO(int8_path, task="detect")
+        print(f"  No images in {IMAGES_DIR}/ to calibrate INT8 with, using FP32 ONNX.")
+    return YOLO(onnx_path, task="detect")
+
+
+def load_reader():
+    """Load EasyOCR, on the GPU when CUDA is available. On CPU with the "onnx"
+    backend its CRAFT text detector runs through ONNX Runtime (see craft_onnx).
+    """
+    gpu = torch.cuda.is_available()
+    reader = easyocr.Reader(["en"], gpu=gpu, quantize=True)
+    # On a GPU the PyTorch detector beats a CPU ONNX Runtime session
+    if gpu or YOLO_BACKEND != "onnx" or not onnxruntime_available():
+        return reader
+
+    export_craft(reader)
+    return use_onnx_detector(reader, threads=INFERENCE_THREADS)
+
+
+def crop_boats(result):
+    """Return the boat crops YOLOv8 found in a single image.
+    Crops are BGR views into the frame Ultralytics already decoded, so each
+    image is read from disk and decoded exactly once.
+    """
+    img = result.orig_img
+    boxes = result.boxes
+    boats = boxes.xyxy[boxes.cls == 8]  # 8 = boat in COCO
+    return [img[y1:y2, x1:x2] for x1, y1, x2, y2 in boats.int().tolist()]
+
+
+def has_legible_detail(gray):
+    """Cheap check for whether a grayscale crop could contain readable lettering.
+    Rejects tiny crops, and crops that are both blurry (low variance of the
+    Laplacian) and nearly edge-free (low Canny edge density).
+    """
+    if min(gray.shape) < OCR_MIN_CROP_SIDE:
+        return False
+    sharpness = cv2.Laplacian(gray, cv2.CV_16S).var()
+    edge_density = cv2.Canny(gray, 100, 200).mean() / 255.0
+    return sharpness >= OCR_MIN_SHARPNESS or edge_density >= OCR_MIN_EDGE_DENSITY
+
 
-            boats_found += 1
-            x1, y1, x2, y2 = map(int, box.xyxy[0].tolist())
-            crop = img.crop((x1, y1, x2, y2))
+def ocr_crops(reader, crops):
+    """OCR a list of BGR crops. Returns one string per crop.
+    On a GPU the text lines of all crops are recognized in one batch: EasyOCR's
+    recognizer only batches the lines of a single image, so the crops are
+    stacked into one grayscale canvas and their text boxes offset into it. On
+    CPU EasyOCR recognizes box by box whatever it is given, so each crop is
+    recognized on its own and no canvas is built.
+    """
+    detected = []
+    for crop in crops:
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.size else None
+        if gray is None or not has_legible_detail(gray):
+            detected.append(None)
+            continue
+        try:
+            h_boxes, f_boxes = reader.detect(np.ascontiguousarray(crop[..., ::-1]))
+        except Exception:
+            h_boxes, f_boxes = [[]], [[]]
+        detected.append((gray, h_boxes[0], f_boxes[0]) if h_boxes[0] or f_boxes[0] else None)
+
+    if not any(detected):
+        return [""] * len(crops)
 
-            # Save temp crop for EasyOCR
-            crop_path = img_path + "_crop_tmp.jpg"
+    if reader.device == "cpu":
+        texts = []
+        for found in detected:
+            if found is None:
+                texts.append("")
+                continue
             try:
-                crop.save(crop_path)
-                ocr_results = reader.readtext(crop_path)
-                text = " ".join([r[1] for r in ocr_results])
-                if text.strip():
-                    all_ocr_text.append(text.strip())
+                texts.append(" ".join(text for _, text, _ in reader.recognize(*found)))
             except Exception:
-                pass
-            finally:
-                if os.path.exists(crop_path):
-                    os.remove(crop_path)
+                texts.append("")
+        return texts
+
+    offsets = []
+    horizontal_list, free_list = [], []
+    top = 0
+    for found in detected:
+        offsets.append(top)
+        if found is None:
+            # Takes no room on the canvas, so no recognized box maps back to it
+            continue
+        gray, h_boxes, f_boxes = found
+        height = gray.shape[0]
+        # Clip to the crop so a box's margin never reaches into its neighbour
+        for x_min, x_max, y_min, y_max in h_boxes:
+            horizontal_list.append([x_min, x_max, max(y_min, 0) + top, min(y_max, height) + top])
+        for points in f_boxes:
+            free_list.append([[x, min(max(y, 0), height) + top] for x, y in points])
+        top += height + OCR_CANVAS_GAP
+
+    canvas = np.zeros((top, max(found[0].shape[1] for found in detected if found)), dtype=np.uint8)
+    for found, y in zip(detected, offsets):
+        if found is not None:
+            canvas[y:y + found[0].shape[0], :found[0].shape[1]] = found[0]
+
+    texts = [[] for _ in crops]
+    try:
+        for box, text, _ in reader.recognize(canvas, horizontal_list, free_list, batch_size=OCR_BATCH_SIZE):
+            y = min(point[1] for point in box)
+            texts[bisect.bisect_right(offsets, y) - 1].append(text)
+    except Exception:
+        pass
+    return [" ".join(t) for t in texts]
+
+
+@torch.inference_mode()
+def analyze_batch(reader, results):
+    """Crop the boats YOLOv8 found in a batch of images and OCR them all at once.
+    Returns a list of (is_dura_bulk, details_string), one per result.
+    """
+    crops = []
+    owners = []
+    for idx, result in enumerate(results):
+        image_crops = crop_boats(result)
+        crops.extend(image_crops)
+        owners.extend([idx] * len(image_crops))
+
+    boats_found = [0] * len(results)
+    all_ocr_text = [[] for _ in results]
+    for idx, text in zip(owners, ocr_crops(reader, crops)):
+        boats_found[idx] += 1
+        if text.strip():
+            all_ocr_text[idx].append(text.strip())
+
+    analyses = []
+    for boats, ocr_text in zip(boats_found, all_ocr_text):
+        combined_text = " | ".join(ocr_text)
+        is_dura = fuzzy_match_dura_bulk(combined_text) if combined_text else False
+
+        details = f"boats={boats}"
+        if combined_text:
+            details += f", ocr_text=\"{combined_text}\""
+        analyses.append((is_dura, details))
+
+    return analyses
+
+
+def get_model():
+    """Return the process-wide YOLOv8 detector, loading it on first use."""
+    global _model
+    if _model is None:
+        _model = load_model()
+    return _model
+
+
+def get_reader():
+    """Return the process-wide EasyOCR reader, loading it on first use."""
+    global _reader
+    if _reader is None:
+        _reader = load_reader()
+    return _reader
+
 
-    combined_text = " | ".join(all_ocr_text)
-    is_dura = fuzzy_match_dura_bulk(combined_text) if combined_text else False
+def warmup():
+    """Load both models and push a blank frame through them, so the first real
+    image doesn't pay for lazy initialisation (ORT graph optimisation, oneDNN
+    workspaces, ...).
+    """
+    blank = np.zeros((YOLO_IMGSZ, YOLO_IMGSZ, 3), dtype=np.uint8)
+    get_model().predict(blank, **YOLO_PREDICT_ARGS)
+    get_reader().readtext(blank)
+
+
+def analyze_image(img_path):
+    """Analyze a single image with the shared models.
+    Returns (is_dura_bulk, details_string).
+    """
+    results = get_model().predict(img_path, **YOLO_PREDICT_ARGS)
+    return analyze_batch(get_reader(), results)[0]
 
-    details = f"boats={boats_found}"
-    if combined_text:
-        details += f", ocr_text=\"{combined_text}\""
 
-    return is_dura, details
+def init_worker():
+    """Pool initializer: each worker process runs its models single-threaded."""
+    global INFERENCE_THREADS
+    INFERENCE_THREADS = 1
+    torch.set_num_threads(1)
+    cv2.setNumThreads(0)
+
+
+def analyze_paths(paths):
+    """Detect and OCR one batch of image paths with this process's shared models.
+    Returns a list of (path, is_dura_bulk, details_string).
+    """
+    results = list(get_model().predict(source=paths, batch=len(paths), **YOLO_PREDICT_ARGS))
+    return [(result.path, *analysis) for result, analysis in zip(results, analyze_batch(get_reader(), results))]
 
 
 def main():
@@ -90,25 +404,99 @@ def main():
         print("No images listed in image-list.json.")
         sys.exit(0)
 
-    print(f"Loading models...")
-    model = YOLO("yolov8n.pt")
-    reader = easyocr.Reader(["en"], gpu=False)
+    captions = {}
+    if os.path.exists(CAPTIONS_FILE):
+        with open(CAPTIONS_FILE) as f:
+            captions = json.load(f)
 
     print(f"Analyzing {len(image_names)} images...\n")
     results = {}
+    total = len(image_names)
+    pending = {}
 
     for i, name in enumerate(image_names):
         img_path = os.path.join(IMAGES_DIR, name)
         if not os.path.exists(img_path):
-            print(f"  [{i+1}/{len(image_names)}] SKIP {name} (file not found)")
+            print(f"  [{i+1}/{total}] SKIP {name} (file not found)")
             results[name] = {"dura_bulk": False, "details": "file not found"}
             continue
 
-        is_dura, details = analyze_image(model, reader, img_path)
+        # A post that names Dura Bulk in its caption needs no vision at all
+        if fuzzy_match_dura_bulk(CAPTION_NOISE.sub(" ", captions.get(name, ""))):
+            print(f"  [{i+1}/{total}]  DURA BULK  {name}  (caption)")
+            results[name] = {"dura_bulk": True, "details": "Dura Bulk named in caption"}
+            continue
+
+        # Image.open only parses the header, so this costs no decode
+        try:
+            with Image.open(img_path) as img:
+                short_side = min(img.size)
+        except Exception as e:
+            print(f"  [{i+1}/{total}] SKIP {name} (could not open image)")
+            results[name] = {"dura_bulk": False, "details": f"Could not open image: {e}"}
+            continue
+        if short_side < MIN_IMAGE_SIDE:
+            print(f"  [{i+1}/{total}] SKIP {name} (too small: {short_side}px)")
+            results[name] = {"dura_bulk": False, "details": f"too small: {short_side}px"}
+            continue
+
+        pending[os.path.abspath(img_path)] = (i, name)
+
+    def report(path, is_dura, details):
+        i, name = pending.pop(os.path.abspath(path))
         label = "DURA BULK" if is_dura else "other"
-        print(f"  [{i+1}/{len(image_names)}] {label:>10}  {name}  ({details})")
+        print(f"  [{i+1}/{total}] {label:>10}  {name}  ({details})")
         results[name] = {"dura_bulk": is_dura, "details": details}
 
+    paths = list(pending)
+    if paths:
+        # Ultralytics decodes and runs a list source as a single batch whatever
+        # batch= says, so the paths are sliced into YOLO batches here
+        batches = [paths[i:i + YOLO_BATCH_SIZE] for i in range(0, len(paths), YOLO_BATCH_SIZE)]
+        if ANALYZE_PROCESSES > 1:
+            # One process per physical core, each with its own single-threaded
+            # models, fed one YOLO batch of paths at a time
+            context = multiprocessing.get_context("spawn")  # torch is not fork-safe
+            with context.Pool(ANALYZE_PROCESSES, initializer=init_worker) as pool:
+                for analyses in pool.imap_unordered(analyze_paths, batches):
+                    for analysis in analyses:
+                        report(*analysis)
+        else:
+            torch.set_num_threads(INFERENCE_THREADS)
+            torch.set_num_interop_threads(1)
+
+            print(f"Loading models...")
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                reader_future = pool.submit(get_reader)
+                model = get_model()
+                reader = reader_future.result()
+
+            # Detect boats one batch at a time; the generator only runs YOLO on
+            # a batch when the loop below asks for it
+            detections = (
+                list(model.predict(source=batch, batch=len(batch), **YOLO_PREDICT_ARGS))
+                for batch in batches
+            )
+
+            # OCR finished batches on worker threads while YOLO moves on to the
+            # next one; at most ANALYZE_WORKERS batches are in flight at a time.
+            with ThreadPoolExecutor(max_workers=ANALYZE_WORKERS) as pool:
+                in_flight = collections.deque()
+                for batch in detections:
+                    in_flight.append((batch, pool.submit(analyze_batch, reader, batch)))
+                    if len(in_flight) >= ANALYZE_WORKERS:
+                        batch, future = in_flight.popleft()
+                        for result, analysis in zip(batch, future.result()):
+                            report(result.path, *analysis)
+                while in_flight:
+                    batch, future = in_flight.popleft()
+                    for result, analysis in zip(batch, future.result()):
+                        report(result.path, *analysis)
+
+    for i, name in pending.values():
+        print(f"  [{i+1}/{total}] SKIP {name} (could not open image)")
+        results[name] = {"dura_bulk": False, "details": "Could not open image"}
+
     with open(RESULTS_FILE, "w") as f:
         json.dump(results, f, indent=2)
 
@@ -117,5 +505,10 @@ def main():
     print(f"Results written to {RESULTS_FILE}")
 
 
+# Let importers (e.g. a long-running server) pay the model load at import time
+if os.environ.get("PRELOAD_MODELS"):
+    warmup()
+
+
 if __name__ == "__main__":
     main()
@@ -1,18 +1,26 @@
 import os
+import json
+import hashlib
 import uuid
 import shutil
+import sqlite3
 import threading
+import time
 import tempfile
-import zipfile
-import io
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import closing
 from datetime import datetime
 from pathlib import Path
+from urllib.parse import urlsplit
 
 import requests as http_requests
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from flask import Flask, Response, request, jsonify, send_file, send_from_directory, stream_with_context
 from flask_cors import CORS
 from apify_client import ApifyClient
+from zipstream import ZipStream, ZIP_STORED
 
 app = Flask(__name__)
 CORS(app)
@@ -21,26 +29,170 @@ BASE_DIR = Path(__file__).parent
 DOWNLOADS_DIR = BASE_DIR / "downloads"
 DOWNLOADS_DIR.mkdir(parents=True, exist_ok=True)
 
+DOWNLOAD_WORKERS = 8
+
+# Shared HTTP session so image downloads reuse pooled keep-alive connections
+# to the Instagram CDN instead of a new TCP + TLS handshake per image
+SESSION = http_requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_maxsize=16,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+
+# Images downloaded by earlier jobs: shortcode (or URL hash) -> image path on disk
+CACHE_DB = BASE_DIR / "cache.db"
+
 # Apify API token (set via Render environment variables)
 APIFY_TOKEN = os.environ.get("APIFY_TOKEN", "")
 
-# In-memory job store
+# Finished jobs' download folders are deleted this long after they finish
+JOB_RETENTION = 6 * 60 * 60
+SWEEP_INTERVAL = 10 * 60
+
+# In-memory job store; the oldest finished jobs are forgotten past MAX_JOBS
+MAX_JOBS = 100
 jobs = {}
+# Notified on every job update so /api/events streams can push the change
+jobs_changed = threading.Condition()
+
+
+def update_job(job_id, **fields):
+    """Update a job's fields and wake up everyone streaming its events."""
+    with jobs_changed:
+        jobs[job_id].update(fields)
+        if fields.get("step") in ("done", "error"):
+            jobs[job_id]["finished_at"] = time.time()
+        jobs_changed.notify_all()
+
+
+def job_snapshot(job_id):
+    """Copy of a job taken under the lock, or None for an unknown job, so a
+    reader never serializes a dict a pipeline thread is halfway through updating.
+    """
+    with jobs_changed:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job)
+        snapshot["images"] = list(job["images"])
+        return snapshot
+
+
+def prune_jobs():
+    """Drop the oldest finished jobs once more than MAX_JOBS are stored."""
+    with jobs_changed:
+        excess = len(jobs) - MAX_JOBS
+        if excess <= 0:
+            return
+        finished = [jid for jid, job in jobs.items() if job["step"] in ("done", "error")]
+        for jid in finished[:excess]:
+            del jobs[jid]
+
+
+def sweep_downloads():
+    """Background loop deleting download folders of jobs finished over JOB_RETENTION ago.
+    Folders of jobs no longer in memory (pruned, or from a previous process)
+    are aged by their modification time.
+    """
+    while True:
+        now = time.time()
+        try:
+            folders = list(DOWNLOADS_DIR.iterdir())
+        except OSError:
+            folders = []
+        for folder in folders:
+            # Another worker's sweeper may delete a folder mid-scan; a failure
+            # here must never end the loop
+            try:
+                if not folder.is_dir():
+                    continue
+                job = jobs.get(folder.name)
+                if job is None:
+                    finished_at = folder.stat().st_mtime
+                else:
+                    finished_at = job.get("finished_at")
+                    if finished_at is None:
+                        continue  # still running
+                if now - finished_at > JOB_RETENTION:
+                    shutil.rmtree(folder, ignore_errors=True)
+            except OSError:
+                continue
+        time.sleep(SWEEP_INTERVAL)
+
+
+threading.Thread(target=sweep_downloads, daemon=True).start()
+
+
+def cache_db():
+    """Open the image cache, creating its table on first use."""
+    db = sqlite3.connect(CACHE_DB)
+    # WAL lets the download threads read the cache while another one writes
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, path TEXT)")
+    return db
+
+
+def cache_key(image_url, shortcode):
+    """Cache key for a post image: its shortcode, or a hash of its URL path without one.
+    The CDN signs URLs with a query that changes on every scrape, so it's left out.
+    """
+    if shortcode:
+        return shortcode
+    return "url:" + hashlib.blake2b(urlsplit(image_url).path.encode(), digest_size=16).hexdigest()
+
+
+def cached_image(key):
+    """Return the image an earlier job downloaded under this key, if it still exists."""
+    with closing(cache_db()) as db:
+        row = db.execute("SELECT path FROM images WHERE key = ?", (key,)).fetchone()
+    if row and os.path.exists(row[0]):
+        return row[0]
+    return None
+
+
+def remember_image(key, path):
+    with closing(cache_db()) as db, db:
+        db.execute("INSERT OR REPLACE INTO images (key, path) VALUES (?, ?)", (key, str(path)))
+
+
+def download_image(image_url, filepath, shortcode):
+    """Fetch one post image into filepath. Returns True if the file was written."""
+    key = cache_key(image_url, shortcode)
+    cached = cached_image(key)
+    if cached:
+        # Already downloaded by an earlier job: link it instead of re-fetching
+        try:
+            os.link(cached, filepath)
+        except OSError:
+            shutil.copyfile(cached, filepath)
+        return True
+
+    # Stream the body to disk in chunks instead of holding the whole image in
+    # memory, under a temporary name so a broken transfer never looks finished
+    partial = filepath.with_suffix(".part")
+    try:
+        with SESSION.get(image_url, timeout=30, stream=True) as resp:
+            if resp.status_code != 200:
+                return False
+            resp.raw.decode_content = True
+            with open(partial, "wb") as f:
+                shutil.copyfileobj(resp.raw, f, 64 * 1024)
+        os.replace(partial, filepath)
+    finally:
+        partial.unlink(missing_ok=True)
+    remember_image(key, filepath)
+    return True
 
 
 def run_pipeline(job_id, name, start_date, end_date, max_posts=100, is_hashtag=False):
     """Background pipeline: scrape via Apify → download images."""
-    job = jobs[job_id]
-
     try:
         # --- Step 1: Scrape via Apify ---
-        job["step"] = "scraping"
         label = f"#{name}" if is_hashtag else f"@{name}"
-        job["detail"] = f"Fetching posts from {label} via Apify..."
+        update_job(job_id, step="scraping", detail=f"Fetching posts from {label} via Apify...")
 
         if not APIFY_TOKEN:
-            job["step"] = "error"
-            job["detail"] = "Apify API token not configured. Set APIFY_TOKEN env var."
+            update_job(job_id, step="error", detail="Apify API token not configured. Set APIFY_TOKEN env var.")
             return
 
         # Create a job-specific download folder
@@ -60,15 +212,17 @@ def run_pipeline(job_id, name, start_date, end_date, max_posts=100, is_hashtag=F
             run_input["directUrls"] = [f"https://www.instagram.com/{name}/"]
             run_input["resultsType"] = "posts"
 
-        job["detail"] = f"Running Apify scraper for {label}... (this may take a minute)"
-        job["total"] = max_posts
-        job["current"] = 0
+        update_job(
+            job_id,
+            detail=f"Running Apify scraper for {label}... (this may take a minute)",
+            total=max_posts,
+            current=0,
+        )
 
         try:
             run = client.actor("apify/instagram-scraper").call(run_input=run_input)
         except Exception as e:
-            job["step"] = "error"
-            job["detail"] = f"Apify scraper failed: {e}"
+            update_job(job_id, step="error", detail=f"Apify scraper failed: {e}")
             return
 
         # Download images from results
@@ -76,34 +230,32 @@ def run_pipeline(job_id, name, start_date, end_date, max_posts=100, is_hashtag=F
         end_dt = datetime.strptime(end_date, "%Y-%m-%d")
 
         all_items = list(client.dataset(run["defaultDatasetId"]).iterate_items())
-        job["detail"] = f"Got {len(all_items)} items from Apify. Downloading..."
+        update_job(job_id, detail=f"Got {len(all_items)} items from Apify. Downloading...")
 
         if not all_items:
-            job["step"] = "done"
-            job["detail"] = "Apify returned 0 items from dataset."
-            job["results"] = {"images": []}
+            update_job(job_id, step="done", detail="Apify returned 0 items from dataset.", results={"images": []})
             return
 
-        count = 0
-        downloaded = []
+        tasks = []
         skipped_date = 0
         skipped_video = 0
         skipped_no_url = 0
 
         for item in all_items:
-            if count >= max_posts:
+            if len(tasks) >= max_posts:
                 break
 
-            # Filter by date if timestamp available
+            # Parse the timestamp once for both the date filter and the filename
+            post_dt = None
             timestamp = item.get("timestamp")
             if timestamp:
                 try:
-                    post_date = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).date()
-                    if post_date > end_dt.date() or post_date < start_dt.date():
-                        skipped_date += 1
-                        continue
+                    post_dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
                 except Exception:
                     pass
+            if post_dt and not start_dt.date() <= post_dt.date() <= end_dt.date():
+                skipped_date += 1
+                continue
 
             # Skip videos
             if item.get("type") == "Video":
@@ -132,45 +284,47 @@ def run_pipeline(job_id, name, start_date, end_date, max_posts=100, is_hashtag=F
                 continue
 
             # Build filename: YYYYMMDD_profilename_NNN.jpg
-            date_prefix = ""
-            if timestamp:
-                try:
-                    post_dt = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
-                    date_prefix = post_dt.strftime("%Y%m%d")
-                except Exception:
-                    pass
-            if not date_prefix:
-                date_prefix = "nodate"
+            date_prefix = post_dt.strftime("%Y%m%d") if post_dt else "nodate"
 
             owner = item.get("ownerUsername") or name
-            filename = f"{date_prefix}_{owner}_{count:03d}.jpg"
-            filepath = job_dir / filename
+            filename = f"{date_prefix}_{owner}_{len(tasks):03d}.jpg"
+            tasks.append((image_url, job_dir / filename, item.get("shortCode")))
 
-            try:
-                resp = http_requests.get(image_url, timeout=30)
-                if resp.status_code == 200:
-                    with open(filepath, "wb") as f:
-                        f.write(resp.content)
-                    downloaded.append(filename)
-                    count += 1
-                    job["current"] = count
-                    job["detail"] = f"Downloading from {label}: {count} images..."
-            except Exception:
-                continue
+        # Shared with the job so /api/status?since=N can list images as they arrive
+        downloaded = jobs[job_id]["images"]
+        update_job(job_id, total=len(tasks))
+
+        # Downloads are network-bound, so a thread pool overlaps their round trips
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            futures = {pool.submit(download_image, *task): task[1].name for task in tasks}
+            for future in as_completed(futures):
+                try:
+                    if not future.result():
+                        continue
+                except Exception:
+                    continue
+                with jobs_changed:
+                    downloaded.append(futures[future])
+                update_job(job_id, current=len(downloaded), detail=f"Downloading from {label}: {len(downloaded)} images...")
 
         # --- Done ---
-        job["step"] = "done"
+        done = set(downloaded)
         if not downloaded:
-            job["detail"] = f"No images downloaded. {len(all_items)} items: {skipped_date} filtered by date, {skipped_video} videos, {skipped_no_url} had no image URL."
+            detail = f"No images downloaded. {len(all_items)} items: {skipped_date} filtered by date, {skipped_video} videos, {skipped_no_url} had no image URL."
         else:
-            job["detail"] = f"Done! Downloaded {len(downloaded)} images."
-        job["total"] = len(downloaded)
-        job["current"] = len(downloaded)
-        job["results"] = {"images": downloaded}
+            detail = f"Done! Downloaded {len(downloaded)} images."
+        update_job(
+            job_id,
+            step="done",
+            detail=detail,
+            total=len(downloaded),
+            current=len(downloaded),
+            # Keep the listing in post order rather than completion order
+            results={"images": [path.name for _, path, _ in tasks if path.name in done]},
+        )
 
     except Exception as e:
-        job["step"] = "error"
-        job["detail"] = str(e)
+        update_job(job_id, step="error", detail=str(e))
 
 
 # --- Routes ---
@@ -199,13 +353,16 @@ def start_scrape():
         return jsonify({"error": "Missing required fields"}), 400
 
     job_id = str(uuid.uuid4())[:8]
-    jobs[job_id] = {
-        "step": "queued",
-        "detail": "Starting...",
-        "current": 0,
-        "total": 0,
-        "results": None,
-    }
+    with jobs_changed:
+        jobs[job_id] = {
+            "step": "queued",
+            "detail": "Starting...",
+            "current": 0,
+            "total": 0,
+            "results": None,
+            "images": [],
+        }
+    prune_jobs()
 
     thread = threading.Thread(
         target=run_pipeline,
@@ -219,10 +376,67 @@ def start_scrape():
 
 @app.route("/api/status/<job_id>")
 def job_status(job_id):
-    job = jobs.get(job_id)
+    """Job progress. With ?since=N, only the images downloaded after the first N
+    are returned, plus a cursor to pass as `since` on the next poll.
+    """
+    job = job_snapshot(job_id)
     if not job:
         return jsonify({"error": "Job not found"}), 404
-    return jsonify(job)
+
+    since = request.args.get("since", type=int)
+    if since is None:
+        return jsonify(job)
+
+    images = job["images"][since:]
+    return jsonify({
+        "step": job["step"],
+        "detail": job["detail"],
+        "current": job["current"],
+        "total": job["total"],
+        "images": images,
+        "cursor": since + len(images),
+    })
+
+
+@app.route("/api/events/<job_id>")
+def job_events(job_id):
+    """Server-Sent Events stream of a job's progress.
+    Each event carries only the fields that changed since the previous one.
+    """
+    if job_id not in jobs:
+        return jsonify({"error": "Job not found"}), 404
+
+    def snapshot():
+        # The growing image list is served by /api/status?since=N instead
+        return {k: v for k, v in jobs.get(job_id, {}).items() if k != "images"}
+
+    def stream():
+        sent = {}
+        while True:
+            with jobs_changed:
+                jobs_changed.wait_for(lambda: snapshot() != sent, timeout=15)
+                job = snapshot()
+            if not job:
+                return
+            delta = {k: v for k, v in job.items() if sent.get(k) != v}
+            # A comment line keeps idle connections from being closed by proxies
+            yield f"data: {json.dumps(delta)}\n\n" if delta else ": keepalive\n\n"
+            sent = job
+            if job["step"] in ("done", "error"):
+                return
+
+    return Response(
+        stream_with_context(stream()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/api/cache/clear", methods=["POST"])
+def clear_cache():
+    with closing(cache_db()) as db, db:
+        db.execute("DELETE FROM images")
+    return jsonify({"cleared": True})
 
 
 @app.route("/api/images/<job_id>/<filename>")
@@ -239,18 +453,22 @@ def download_zip(job_id):
     if not folder.exists():
         return "Not found", 404
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
-        for f in folder.iterdir():
-            if f.is_file():
-                zf.write(f, f.name)
-    buf.seek(0)
-
-    return send_file(
-        buf,
+    # Images are already JPEG-compressed, so store them as-is and stream the
+    # archive while it is being built instead of assembling it in memory
+    zs = ZipStream(compress_type=ZIP_STORED, sized=True)
+    # scandir's entries carry the file type from readdir, so no stat per file
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.endswith(".part"):
+                zs.add_path(entry.path, entry.name)
+
+    return Response(
+        zs,
         mimetype="application/zip",
-        as_attachment=True,
-        download_name=f"images_{job_id}.zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="images_{job_id}.zip"',
+            "Content-Length": str(len(zs)),
+        },
     )
 
 
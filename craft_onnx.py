@@ -0,0 +1,63 @@
+"""
+Run EasyOCR's CRAFT text detector through ONNX Runtime.
+
+Shared by analyze.py and local_analyze.py: the detector is exported once to
+CRAFT_ONNX, then swapped into a Reader in place of its PyTorch module. The
+CRNN recognizer stays in PyTorch, where EasyOCR already quantizes it to INT8
+on CPU.
+"""
+
+import os
+
+import torch
+
+CRAFT_ONNX = "craft_mlt_25k.onnx"
+
+
+def onnxruntime_available():
+    try:
+        import onnxruntime  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_craft(reader, path=CRAFT_ONNX):
+    """Export reader's CRAFT detector to ONNX at path, unless it is already there.
+    Height and width are dynamic, so the dummy input's size doesn't matter.
+    """
+    if os.path.exists(path):
+        return
+    craft = getattr(reader.detector, "module", reader.detector)
+    torch.onnx.export(
+        craft,
+        torch.zeros(1, 3, 640, 640),
+        path,
+        input_names=["image"],
+        output_names=["y", "feature"],
+        dynamic_axes={
+            "image": {0: "batch", 2: "height", 3: "width"},
+            "y": {0: "batch", 1: "out_height", 2: "out_width"},
+            "feature": {0: "batch", 2: "out_height", 3: "out_width"},
+        },
+        opset_version=17,
+    )
+
+
+def use_onnx_detector(reader, path=CRAFT_ONNX, threads=1):
+    """Replace reader's detector with an ONNX Runtime session over the model at path."""
+    import onnxruntime as ort
+
+    so = ort.SessionOptions()
+    so.intra_op_num_threads = threads
+    so.inter_op_num_threads = 1
+    so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    session = ort.InferenceSession(path, sess_options=so, providers=["CPUExecutionProvider"])
+
+    # EasyOCR calls detector(x) with a torch batch and reads back (y, feature)
+    def detect_text(x):
+        y, feature = session.run(None, {"image": x.cpu().numpy()})
+        return torch.from_numpy(y), torch.from_numpy(feature)
+
+    reader.detector = detect_text
+    return reader
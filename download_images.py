@@ -4,21 +4,23 @@ Download images from @durabulk on Instagram.
 Run this once locally before deploying the static site.
 
 Usage:
-    pip install instaloader
+    pip install instaloader "httpx[http2]"
     python download_images.py
 """
 
 import instaloader
 import json
 import os
-import shutil
 from datetime import datetime
 
+from image_downloader import Downloader
+
 PROFILE = "durabulk"
 OUTPUT_DIR = "images"
 MAX_POSTS = 100
 START_DATE = "2025-01-01"
 END_DATE = "2025-12-31"
+CAPTIONS_FILE = "captions.json"
 
 
 def main():
@@ -43,54 +45,64 @@ def main():
     print(f"Fetching posts from @{PROFILE}...")
     profile = instaloader.Profile.from_username(L.context, PROFILE)
 
+    # One directory scan up front instead of a stat per post and a re-list at the end
+    existing = {
+        entry.name for entry in os.scandir(OUTPUT_DIR)
+        if entry.name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+    }
     image_files = []
-    count = 0
-
-    for post in profile.get_posts():
-        if count >= MAX_POSTS:
-            break
-        post_date = post.date_utc
-        if post_date.date() > end_dt.date():
-            continue
-        if post_date.date() < start_dt.date():
-            break
-        if post.is_video:
-            continue
-
-        filename = f"{post.date_utc.strftime('%Y%m%d_%H%M%S')}_{post.shortcode}.jpg"
-        filepath = os.path.join(OUTPUT_DIR, filename)
-
-        if not os.path.exists(filepath):
-            try:
-                stem = os.path.splitext(filepath)[0]
-                L.download_pic(stem, post.url, post.date_utc)
-                for ext in [".jpg", ".jpeg", ".png", ".webp"]:
-                    candidate = stem + ext
-                    if os.path.exists(candidate) and candidate != filepath:
-                        shutil.move(candidate, filepath)
-                        break
-            except Exception as e:
-                print(f"  Skipped: {e}")
-                continue
-
-        if os.path.exists(filepath):
-            image_files.append(filename)
-            count += 1
-            print(f"  [{count}/{MAX_POSTS}] {filename}")
+    # Caption per image, so analyze.py can skip vision on posts that already
+    # name Dura Bulk. Instagram's alt text is left out: it starts with
+    # "Photo by <owner>", which names Dura Bulk on every post.
+    captions = {}
+    if os.path.exists(CAPTIONS_FILE):
+        with open(CAPTIONS_FILE) as f:
+            captions = json.load(f)
+
+    # instaloader is only used to list posts; each image starts downloading
+    # on the Downloader's event loop as soon as its post is listed
+    with Downloader() as downloader:
+        try:
+            for post in profile.get_posts():
+                if len(image_files) + len(downloader.pending) >= MAX_POSTS:
+                    break
+                post_date = post.date_utc
+                if post_date.date() > end_dt.date():
+                    continue
+                if post_date.date() < start_dt.date():
+                    break
+                if post.is_video:
+                    continue
+
+                filename = f"{post.date_utc.strftime('%Y%m%d_%H%M%S')}_{post.shortcode}.jpg"
+                filepath = os.path.join(OUTPUT_DIR, filename)
+                captions[filename] = post.caption or ""
+
+                if filename in existing:
+                    image_files.append(filename)
+                else:
+                    downloader.submit(post.url, filepath, post.date_utc)
+        except Exception as e:
+            # Rate limits and login checkpoints end the listing, not the run
+            print(f"Stopped listing posts early: {e}")
+
+    for filepath in downloader.downloaded:
+        image_files.append(os.path.basename(filepath))
+        existing.add(os.path.basename(filepath))
 
     print(f"\nDownloaded {len(image_files)} images.")
 
     # Generate image list JSON for the static site
-    all_images = sorted(
-        f for f in os.listdir(OUTPUT_DIR)
-        if f.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
-    )
+    all_images = sorted(existing)
 
     with open("image-list.json", "w") as f:
         json.dump(all_images, f, indent=2)
 
     print(f"Wrote image-list.json with {len(all_images)} entries.")
 
+    with open(CAPTIONS_FILE, "w") as f:
+        json.dump(captions, f, indent=2)
+
 
 if __name__ == "__main__":
     main()
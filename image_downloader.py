@@ -0,0 +1,95 @@
+"""
+Concurrent Instagram image downloads for download_images.py and
+local_download_images.py.
+
+instaloader lists posts one page at a time; a Downloader fetches each image
+on a background event loop as soon as its post is submitted, so downloads
+overlap with the listing instead of waiting for it to finish.
+"""
+
+import asyncio
+import os
+import threading
+from datetime import datetime
+
+import httpx
+
+DOWNLOAD_CONCURRENCY = 8
+MAX_RETRIES = 4
+
+
+async def download_one(client, semaphore, url, filepath, mtime):
+    """Download a single image, backing off exponentially on HTTP 429."""
+    async with semaphore:
+        for attempt in range(MAX_RETRIES):
+            resp = await client.get(url)
+            if resp.status_code != 429:
+                break
+            await asyncio.sleep(2 ** attempt)
+        resp.raise_for_status()
+
+    # Written under a temporary name and renamed into place, so an interrupted
+    # write never looks finished and a re-download gets a new inode instead of
+    # writing through hardlinks local_analyze.py made to the old file
+    partial = f"{filepath}.part"
+    try:
+        with open(partial, "wb") as f:
+            f.write(resp.content)
+        # Same timestamps instaloader's download_pic sets
+        os.utime(partial, (datetime.now().timestamp(), mtime.timestamp()))
+        os.replace(partial, filepath)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    print(f"  {os.path.basename(filepath)}")
+
+
+class Downloader:
+    """Download images on a background event loop while the caller keeps listing posts.
+
+        with Downloader() as downloader:
+            for post in posts:
+                downloader.submit(post.url, filepath, post.date_utc)
+        print(downloader.downloaded)
+
+    Leaving the block waits for every submitted download; the filepaths that
+    succeeded end up in downloaded, in submission order.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.pending = []
+        self.downloaded = []
+
+    def __enter__(self):
+        self.thread.start()
+        self.client, self.semaphore = self._run(self._open())
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        for filepath, future in self.pending:
+            if exc_type is not None:
+                future.cancel()
+            try:
+                future.result()
+                self.downloaded.append(filepath)
+            except Exception as e:
+                print(f"  Skipped {os.path.basename(filepath)}: {e}")
+        self._run(self.client.aclose())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    def submit(self, url, filepath, mtime):
+        """Start downloading url to filepath; returns immediately."""
+        coro = download_one(self.client, self.semaphore, url, filepath, mtime)
+        self.pending.append((filepath, asyncio.run_coroutine_threadsafe(coro, self.loop)))
+
+    async def _open(self):
+        limits = httpx.Limits(max_connections=DOWNLOAD_CONCURRENCY)
+        client = httpx.AsyncClient(http2=True, limits=limits, timeout=30)
+        return client, asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
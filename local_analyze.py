@@ -5,43 +5,357 @@ Usage:
     python local_analyze.py
     python local_analyze.py --input my_images
     python local_analyze.py --input images --output results
+    python local_analyze.py --device cpu
+    # One OCR worker process per physical core (e.g. 4); each loads its own reader:
+    python local_analyze.py --workers 4
+    python local_analyze.py --link-mode copy
 
-Images containing "Dura Bulk" (or partial matches) are copied to
-<output>/dura_bulk/ and the rest to <output>/non_dura_bulk/.
+    # INT8-quantized text detector on ONNX Runtime (pip install onnx onnxruntime):
+    python local_analyze.py --detector int8
+
+    # Reuse a reader kept loaded by local_analyze_daemon.py, if one is running:
+    python local_analyze_daemon.py &
+    python local_analyze.py
+
+Images containing "Dura Bulk" (or a close misspelling) are hardlinked (or copied,
+see --link-mode) to <output>/dura_bulk/ and the rest to <output>/non_dura_bulk/.
 """
 
 import argparse
-import re
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import easyocr
+import numpy as np
+import torch
 from PIL import Image
+from rapidfuzz.fuzz import partial_ratio, ratio
+
+from craft_onnx import CRAFT_ONNX, export_craft, onnxruntime_available, use_onnx_detector
+from text_match import alnum
+
+# Minimum ratio/partial_ratio (0-100) for OCR text to count as "durabulk"
+FUZZY_CUTOFF = 75
+
+# Images of the same size are OCR'd this many at a time, so the text detector
+# runs once per batch (see size_batches)
+OCR_BATCH_SIZE = 16
+
+# INT8 copy of craft_onnx's CRAFT_ONNX (see export_detector)
+CRAFT_INT8 = "craft_mlt_25k.int8.onnx"
+
+# Where local_analyze_daemon.py serves a preloaded reader
+DAEMON_SOCKET = "/tmp/durabulk.sock"
+
+# Linux ioctl that makes a file share another's extents (Btrfs, XFS)
+FICLONE = 0x40049409
 
 
 def fuzzy_match_dura_bulk(text):
-    """Check if text contains 'dura bulk' or partial matches."""
-    text = text.lower().strip()
-    cleaned = re.sub(r"[^a-z0-9]", "", text)
+    """Check if text contains 'dura bulk', or a stretch of it that is a close
+    misspelling of 'durabulk'. Text shorter than 'durabulk' is scored as a whole.
+    """
+    cleaned = alnum(text).decode()
 
-    if "dura" in text and "bulk" in text:
-        return True
-    if "durabulk" in cleaned:
+    # Text with neither the d nor the b of "durabulk" is rejected here by
+    # C-level checks before any fuzzy matching
+    if "d" not in cleaned and "b" not in cleaned:
+        return False
+
+    # Also covers "durabulk" and "dura bulk" split by punctuation or spaces
+    if "dura" in cleaned and "bulk" in cleaned:
         return True
 
-    # Partial matches (4+ char substrings of "durabulk")
-    target = "durabulk"
-    for length in range(4, len(target) + 1):
-        for start in range(len(target) - length + 1):
-            if target[start:start + length] in cleaned:
-                return True
+    # partial_ratio would align short text inside "durabulk" and score a lone
+    # "bulk" 100, so it gets the plain edit-distance ratio instead: "urabulk"
+    # still matches, "bulk" does not
+    if len(cleaned) < len("durabulk"):
+        return ratio("durabulk", cleaned, score_cutoff=FUZZY_CUTOFF) >= FUZZY_CUTOFF
+
+    # Best alignment of "durabulk" against any 8-letter window of the OCR text,
+    # in one bit-parallel call
+    return partial_ratio("durabulk", cleaned, score_cutoff=FUZZY_CUTOFF) >= FUZZY_CUTOFF
+
+
+def load_image(path):
+    """Read and decode an image. Returns (file bytes, RGB array); if it can't be
+    read the bytes are None and the array is the Exception.
+    """
+    try:
+        raw = path.read_bytes()
+        with Image.open(io.BytesIO(raw)) as img:
+            # Color, not grayscale: the CRAFT detector uses chroma contrast to
+            # find lettering, and EasyOCR grays the image for the recognizer itself
+            return raw, np.asarray(img.convert("RGB"))
+    except Exception as e:
+        return None, e
+
+
+def size_batches(paths, batch_size):
+    """Split paths into batches of at most batch_size images that share one pixel
+    size, since readtext_batched stacks its inputs. Instagram serves only a few
+    sizes, so the batches stay nearly full without resizing any image.
+    """
+    by_size = {}
+    for path in paths:
+        # Image.open only parses the header, so this costs no decode
+        try:
+            with Image.open(path) as img:
+                size = img.size
+        except Exception:
+            size = None
+        by_size.setdefault(size, []).append(path)
+    return [group[i:i + batch_size] for group in by_size.values() for i in range(0, len(group), batch_size)]
+
+
+def load_batch(paths):
+    return [load_image(path) for path in paths]
+
+
+def ocr_batch(reader, images):
+    """OCR a batch of decoded images (see load_batch), one CRAFT pass for the whole batch.
+    Returns one readtext-style result list per image, or the Exception for an
+    image that could not be read.
+    """
+    readable = [img for img in images if not isinstance(img, Exception)]
+    try:
+        found = iter(reader.readtext_batched(readable, batch_size=OCR_BATCH_SIZE))
+        return [img if isinstance(img, Exception) else next(found) for img in images]
+    except Exception:
+        pass
+
+    # One bad image fails the whole batch, so redo it image by image
+    results = []
+    for img in images:
+        try:
+            results.append(img if isinstance(img, Exception) else reader.readtext(img))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def ocr_texts(reader, images):
+    """ocr_batch, reduced to each image's joined OCR text (or its Exception)."""
+    return [r if isinstance(r, Exception) else " ".join([x[1] for x in r]) for r in ocr_batch(reader, images)]
+
+
+def pick_device(device):
+    """Resolve --device auto to the fastest available backend."""
+    if device != "auto":
+        return device
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def pick_detector(detector, device):
+    """Resolve --detector auto: ONNX Runtime on CPU when it is installed."""
+    if detector != "auto":
+        return detector
+    return "onnx" if device == "cpu" and onnxruntime_available() else "torch"
+
+
+def export_detector(detector):
+    """Write the ONNX files the --detector mode needs, once, before any reader loads them."""
+    if detector == "torch":
+        return
+    if not os.path.exists(CRAFT_ONNX):
+        export_craft(easyocr.Reader(["en"], gpu=False))
+    if detector == "int8" and not os.path.exists(CRAFT_INT8):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        # ONNX Runtime's CPU ConvInteger kernel takes uint8 weights
+        quantize_dynamic(CRAFT_ONNX, CRAFT_INT8, weight_type=QuantType.QUInt8)
+
+
+def load_reader(device, detector="torch"):
+    """Create the EasyOCR reader on device, falling back to CPU if that fails.
+    With an "onnx" or "int8" detector, CRAFT runs through ONNX Runtime (see
+    export_detector and craft_onnx).
+    """
+    reader = None
+    if device != "cpu":
+        try:
+            # cudnn_benchmark tunes convolutions for the fixed batch image size
+            reader = easyocr.Reader(["en"], gpu=device, cudnn_benchmark=True)
+        except Exception as e:
+            print(f"Could not use {device} ({e}), falling back to CPU.")
+    if reader is None:
+        reader = easyocr.Reader(["en"], gpu=False, quantize=True)
+    if detector == "torch":
+        return reader
+
+    model = CRAFT_INT8 if detector == "int8" else CRAFT_ONNX
+    return use_onnx_detector(reader, model, threads=torch.get_num_threads())
+
+
+def place_image(src, dest, link_mode, raw=None):
+    """Put src at dest as a hardlink, reflink or copy, copying if linking fails.
+    raw is src's contents if already in memory, so a copy needn't re-read it.
+    """
+    # Replace results left by an earlier run
+    dest.unlink(missing_ok=True)
+    if link_mode == "hardlink":
+        try:
+            os.link(src, dest)
+            return
+        except OSError:
+            pass
+    elif link_mode == "reflink":
+        try:
+            import fcntl
+            with open(src, "rb") as fsrc, open(dest, "wb") as fdest:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            return
+        except (ImportError, OSError):
+            pass
+    if raw is not None:
+        dest.write_bytes(raw)
+        return
+    # copyfile uses sendfile() and skips copystat
+    shutil.copyfile(src, dest)
+
+
+def content_hash(raw):
+    """Hash OCR text is stored under, so identical images share one entry."""
+    return hashlib.blake2b(raw, digest_size=16).hexdigest()
+
+
+def file_key(path):
+    """(path, size, mtime) an image is looked up by, from one stat and no read."""
+    st = path.stat()
+    return str(path.resolve()), st.st_size, st.st_mtime_ns
+
+
+def open_cache(output_dir):
+    """Open the OCR text cache in the output folder, creating its tables on first use."""
+    db = sqlite3.connect(output_dir / ".cache.sqlite")
+    db.execute("CREATE TABLE IF NOT EXISTS ocr (hash TEXT PRIMARY KEY, text TEXT)")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS files "
+        "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, hash TEXT)"
+    )
+    return db
+
+
+def cached_text(db, key):
+    """Return the OCR text stored for an unchanged file, or None."""
+    row = db.execute(
+        "SELECT ocr.text FROM files JOIN ocr USING (hash) "
+        "WHERE files.path = ? AND files.size = ? AND files.mtime_ns = ?",
+        key,
+    ).fetchone()
+    return row[0] if row else None
+
+
+# Each worker process's own reader (see init_worker)
+_reader = None
+
+
+def init_worker(device, detector):
+    """Pool initializer: one single-threaded reader per worker process."""
+    global _reader
+    torch.set_num_threads(1)
+    _reader = load_reader(device, detector)
+
+
+def ocr_worker(paths):
+    # Not every library exception pickles, so send errors back as plain ones
+    return [RuntimeError(str(t)) if isinstance(t, Exception) else t for t in ocr_texts(_reader, [img for _, img in load_batch(paths)])]
+
+
+def send_message(stream, obj):
+    """Write obj as length-prefixed JSON, the OCR daemon's wire format."""
+    data = json.dumps(obj).encode()
+    stream.write(len(data).to_bytes(4, "big") + data)
+    stream.flush()
 
-    return False
+
+def recv_message(stream):
+    """Read one length-prefixed JSON message, or None once the other end hangs up."""
+    header = stream.read(4)
+    if len(header) < 4:
+        return None
+    return json.loads(stream.read(int.from_bytes(header, "big")))
+
+
+def connect_daemon(path=DAEMON_SOCKET):
+    """Connect to a running local_analyze_daemon.py, or return None if there isn't one."""
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def ocr_all(batches, device, detector, workers, daemon=None):
+    """Yield (file bytes, ocr_texts results) for each batch in order, through the
+    daemon if connected, else in worker processes if workers > 1. The bytes are
+    None where only the daemon or a worker read the file.
+    """
+    if daemon is not None:
+        with daemon, daemon.makefile("rwb") as stream:
+            while batches:
+                try:
+                    send_message(stream, {"paths": [str(path.resolve()) for path in batches[0]]})
+                    results = recv_message(stream)
+                except (OSError, ValueError):
+                    results = None
+                if results is None:
+                    break
+                yield [None] * len(results), [RuntimeError(r["error"]) if "error" in r else r["text"] for r in results]
+                batches = batches[1:]
+        if not batches:
+            return
+        # The daemon went away mid-run: finish the remaining batches here
+        print(f"Lost the OCR daemon; loading OCR engine on {device}, {detector} detector...")
+        export_detector(detector)
+
+    if workers <= 1:
+        reader = load_reader(device, detector)
+        # Decode the next batch on a thread while the current one is OCR'd
+        with ThreadPoolExecutor(max_workers=1) as loader:
+            upcoming = [loader.submit(load_batch, batch) for batch in batches[:1]]
+            for batch in batches[1:] + [None]:
+                loaded = upcoming.pop().result()
+                if batch is not None:
+                    upcoming.append(loader.submit(load_batch, batch))
+                yield [raw for raw, _ in loaded], ocr_texts(reader, [img for _, img in loaded])
+        return
+
+    # Fetch EasyOCR's weights here first; workers downloading them at the same
+    # time would all write to the same temp.zip in the model directory
+    easyocr.Reader(["en"], gpu=False)
+
+    # torch is not fork-safe, so workers start fresh and load their own reader
+    with multiprocessing.get_context("spawn").Pool(workers, initializer=init_worker, initargs=(device, detector)) as pool:
+        for results in pool.imap(ocr_worker, batches):
+            yield [None] * len(results), results
 
 
 def main():
     parser = argparse.ArgumentParser(description="Analyze images locally for Dura Bulk text")
     parser.add_argument("--input", default="images", help="Input directory with images (default: images)")
     parser.add_argument("--output", default="results", help="Output directory (default: results)")
+    parser.add_argument("--device", default="auto", choices=["auto", "cpu", "cuda", "mps"], help="OCR device (default: auto)")
+    parser.add_argument("--detector", default="auto", choices=["auto", "torch", "onnx", "int8"], help="Text detector runtime: PyTorch, ONNX Runtime, or ONNX Runtime INT8 (default: auto)")
+    parser.add_argument("--link-mode", default="hardlink", choices=["copy", "hardlink", "reflink"], help="How images are placed in the output folders (default: hardlink)")
+    parser.add_argument("--workers", type=int, default=1, help="OCR worker processes, each with its own reader; at most one per physical core (default: 1)")
     args = parser.parse_args()
 
     input_dir = Path(args.input)
@@ -54,10 +368,14 @@ def main():
         print("Run local_download_images.py first to download images.")
         return
 
-    image_paths = sorted([
-        f for f in input_dir.iterdir()
-        if f.suffix.lower() in (".jpg", ".jpeg", ".png", ".webp")
-    ])
+    # scandir's entries carry the file type from readdir, so only symlinked
+    # images cost a stat to follow
+    with os.scandir(input_dir) as entries:
+        image_paths = sorted(
+            Path(entry.path) for entry in entries
+            if entry.name.lower().endswith((".jpg", ".jpeg", ".png", ".webp"))
+            and entry.is_file()
+        )
 
     if not image_paths:
         print(f"No images found in '{input_dir}'.")
@@ -66,24 +384,46 @@ def main():
     dura_dir.mkdir(parents=True, exist_ok=True)
     non_dura_dir.mkdir(parents=True, exist_ok=True)
 
-    print(f"Loading OCR engine...")
-    reader = easyocr.Reader(["en"], gpu=False)
+    # Images OCR'd on an earlier run and unchanged since (same size and mtime)
+    # are classified from their cached text without reading them
+    cache = open_cache(output_dir)
+    known_text = {}
+    keys = {}
+    for img_path in image_paths:
+        keys[img_path] = file_key(img_path)
+        text = cached_text(cache, keys[img_path])
+        if text is not None:
+            known_text[img_path] = text
+    to_ocr = [img_path for img_path in image_paths if img_path not in known_text]
+
+    device = pick_device(args.device)
+    detector = pick_detector(args.detector, device)
+    workers = max(1, args.workers)
+    daemon = connect_daemon() if to_ocr else None
+    if daemon is not None:
+        # The daemon's reader is already loaded; it OCRs one batch at a time
+        workers = 1
+        print(f"Using the OCR daemon at {DAEMON_SOCKET} (its own --device and --detector apply, not these)...")
+    elif to_ocr:
+        export_detector(detector)
+        print(f"Loading OCR engine on {device}, {detector} detector ({workers} worker{'s' if workers > 1 else ''})...")
+
+    # Small enough batches that every worker gets some
+    batch_size = max(1, min(OCR_BATCH_SIZE, -(-len(to_ocr) // workers)))
+    batches = size_batches(to_ocr, batch_size)
 
     dura_count = 0
     non_dura_count = 0
+    done = 0
 
-    print(f"Analyzing {len(image_paths)} images...\n")
+    # Copies run on background threads so OCR never waits on the disk
+    copier = ThreadPoolExecutor(max_workers=4)
+    copies = []
 
-    for i, img_path in enumerate(image_paths):
-        try:
-            ocr_results = reader.readtext(str(img_path))
-            all_text = " ".join([r[1] for r in ocr_results])
-            is_dura = fuzzy_match_dura_bulk(all_text)
-        except Exception as e:
-            print(f"  [{i+1}/{len(image_paths)}] Error on {img_path.name}: {e}")
-            is_dura = False
-
-        if is_dura:
+    def classify(img_path, all_text, raw=None):
+        """File one image under its result folder and return its progress line."""
+        nonlocal dura_count, non_dura_count, done
+        if fuzzy_match_dura_bulk(all_text):
             dest = dura_dir / img_path.name
             dura_count += 1
             label = "DURA BULK"
@@ -92,12 +432,45 @@ def main():
             non_dura_count += 1
             label = "other"
 
-        # Copy file to result folder
-        import shutil
-        shutil.copy2(img_path, dest)
+        copies.append(copier.submit(place_image, img_path, dest, args.link_mode, raw))
 
+        done += 1
         ocr_preview = all_text[:60].replace("\n", " ") if all_text.strip() else "(no text)"
-        print(f"  [{i+1}/{len(image_paths)}] {img_path.name} → {label}  |  OCR: {ocr_preview}")
+        return f"  [{done}/{len(image_paths)}] {img_path.name} → {label}  |  OCR: {ocr_preview}\n"
+
+    print(f"Analyzing {len(image_paths)} images ({len(known_text)} cached)...\n")
+
+    sys.stdout.write("".join(classify(img_path, text) for img_path, text in known_text.items()))
+
+    for batch, (raws, batch_results) in zip(batches, ocr_all(batches, device, detector, workers, daemon)):
+        # Progress lines are written once per batch rather than one print per image
+        lines = []
+        seen = []
+        for img_path, raw, all_text in zip(batch, raws, batch_results):
+            if isinstance(all_text, Exception):
+                lines.append(f"  [{done+1}/{len(image_paths)}] Error on {img_path.name}: {all_text}\n")
+                all_text = ""
+            else:
+                # Only the parent's prefetch thread keeps the bytes; for images
+                # the daemon or a worker read, this re-read hits the page cache
+                digest = content_hash(raw if raw is not None else img_path.read_bytes())
+                seen.append((digest, all_text, *keys[img_path]))
+            lines.append(classify(img_path, all_text, raw))
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+
+        with cache:
+            cache.executemany("INSERT OR REPLACE INTO ocr (hash, text) VALUES (?, ?)", [row[:2] for row in seen])
+            cache.executemany(
+                "INSERT OR REPLACE INTO files (hash, path, size, mtime_ns) VALUES (?, ?, ?, ?)",
+                [(row[0], *row[2:]) for row in seen],
+            )
+
+    copier.shutdown()
+    for copy in copies:
+        copy.result()
+
+    cache.close()
 
     print(f"\nDone! {dura_count} Dura Bulk, {non_dura_count} other.")
     print(f"  Dura Bulk images: {dura_dir}/")
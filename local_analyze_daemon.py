@@ -0,0 +1,86 @@
+"""
+Keep an EasyOCR reader loaded between local_analyze.py runs.
+
+Usage:
+    python local_analyze_daemon.py
+    python local_analyze_daemon.py --device cpu --detector int8
+
+While it runs, local_analyze.py sends its images here over a Unix socket
+instead of loading its own reader. Each request is length-prefixed JSON
+{"paths": [...]}; the reply lists {"path", "text", "is_dura"} (or
+{"path", "error"}) per image, in order.
+"""
+
+import argparse
+import os
+import socket
+from pathlib import Path
+
+from local_analyze import (
+    DAEMON_SOCKET,
+    export_detector,
+    fuzzy_match_dura_bulk,
+    load_batch,
+    load_reader,
+    ocr_texts,
+    pick_detector,
+    pick_device,
+    recv_message,
+    send_message,
+)
+
+
+def analyze_paths(reader, paths):
+    paths = [Path(path) for path in paths]
+    results = []
+    for path, text in zip(paths, ocr_texts(reader, [img for _, img in load_batch(paths)])):
+        if isinstance(text, Exception):
+            results.append({"path": str(path), "error": str(text)})
+        else:
+            results.append({"path": str(path), "text": text, "is_dura": fuzzy_match_dura_bulk(text)})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a preloaded OCR reader to local_analyze.py")
+    parser.add_argument("--device", default="auto", choices=["auto", "cpu", "cuda", "mps"], help="OCR device (default: auto)")
+    parser.add_argument("--detector", default="auto", choices=["auto", "torch", "onnx", "int8"], help="Text detector runtime (default: auto)")
+    parser.add_argument("--socket", default=DAEMON_SOCKET, help=f"Unix socket path (default: {DAEMON_SOCKET})")
+    args = parser.parse_args()
+
+    device = pick_device(args.device)
+    detector = pick_detector(args.detector, device)
+    export_detector(detector)
+    print(f"Loading OCR engine on {device}, {detector} detector...")
+    reader = load_reader(device, detector)
+
+    # A socket file left by a daemon that didn't shut down cleanly
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(args.socket)
+        server.listen()
+        print(f"Listening on {args.socket} (Ctrl+C to stop)")
+        try:
+            # One client at a time: the reader is not thread-safe
+            while True:
+                conn, _ = server.accept()
+                # A client that hangs up or sends a malformed request only
+                # loses its own connection
+                try:
+                    with conn, conn.makefile("rwb") as stream:
+                        while (request := recv_message(stream)) is not None:
+                            send_message(stream, analyze_paths(reader, request["paths"]))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                except Exception as e:
+                    print(f"Dropped a client after a bad request: {e!r}")
+        except KeyboardInterrupt:
+            print("\nStopped.")
+        finally:
+            os.unlink(args.socket)
+
+
+if __name__ == "__main__":
+    main()
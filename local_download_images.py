@@ -22,6 +22,8 @@ from pathlib import Path
 
 import instaloader
 
+from image_downloader import Downloader
+
 
 def main():
     parser = argparse.ArgumentParser(description="Download Instagram images locally")
@@ -80,8 +82,6 @@ def main():
         except Exception:
             print(f"WARNING: Could not verify session for '{args.login}'. Continuing anyway...")
 
-    count = 0
-
     if is_hashtag:
         print(f"Fetching posts from #{name}...")
         hashtag = instaloader.Hashtag.from_name(L.context, name)
@@ -91,41 +91,29 @@ def main():
         profile = instaloader.Profile.from_username(L.context, name)
         posts = profile.get_posts()
 
-    for post in posts:
-        if count >= args.max:
-            break
-
-        post_date = post.date_local
-        if post_date.date() < start_dt.date() or post_date.date() > end_dt.date():
-            continue
+    # instaloader is only used to list posts; each image starts downloading
+    # on the Downloader's event loop as soon as its post is listed
+    with Downloader() as downloader:
+        try:
+            for post in posts:
+                if len(downloader.pending) >= args.max:
+                    break
 
-        if post.is_video:
-            continue
+                post_date = post.date_local
+                if post_date.date() < start_dt.date() or post_date.date() > end_dt.date():
+                    continue
 
-        date_str = post_date.strftime("%Y%m%d")
-        owner = post.owner_username if is_hashtag else name
-        filename = f"{date_str}_{owner}_{count:03d}.jpg"
-        filepath = out_dir / filename
+                if post.is_video:
+                    continue
 
-        try:
-            L.download_pic(filename=str(filepath.with_suffix("")), url=post.url, mtime=post_date)
-            # instaloader adds its own extension, rename if needed
-            downloaded = filepath.with_suffix(".jpg")
-            if not downloaded.exists():
-                # Check for other extensions instaloader might have used
-                for ext in [".jpeg", ".png", ".webp"]:
-                    alt = filepath.with_suffix(ext)
-                    if alt.exists():
-                        alt.rename(downloaded)
-                        break
-            if downloaded.exists():
-                count += 1
-                print(f"  [{count}/{args.max}] {filename}")
-            else:
-                print(f"  Skipped (download failed): {post.shortcode}")
+                date_str = post_date.strftime("%Y%m%d")
+                owner = post.owner_username if is_hashtag else name
+                filename = f"{date_str}_{owner}_{len(downloader.pending):03d}.jpg"
+                downloader.submit(post.url, out_dir / filename, post_date)
         except Exception as e:
-            print(f"  Skipped: {e}")
-            continue
+            # Rate limits and login checkpoints end the listing, not the run
+            print(f"Stopped listing posts early: {e}")
+    count = len(downloader.downloaded)
 
     print(f"\nDone! {count} images saved to {out_dir}/")
 
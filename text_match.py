@@ -0,0 +1,12 @@
+"""
+Text cleanup shared by analyze.py and local_analyze.py before they match OCR
+and caption text against "durabulk".
+"""
+
+# Every byte except lowercase ASCII letters and digits, for bytes.translate()
+NON_ALNUM = bytes(b for b in range(256) if b not in b"abcdefghijklmnopqrstuvwxyz0123456789")
+
+
+def alnum(text):
+    """Lowercase text and keep only its ASCII letters and digits, as bytes."""
+    return text.lower().encode("ascii", "ignore").translate(None, NON_ALNUM)